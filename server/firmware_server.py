@@ -4,502 +4,564 @@ Arduino Remote Command Server
 Sends commands to Arduino via ESP8266 bridge
 """
 
-from flask import Flask, jsonify, request, render_template_string
-import json
-from datetime import datetime
-from queue import Queue
+from flask import Flask, Response, abort, request
+from flask.json.provider import JSONProvider
+from werkzeug.http import parse_accept_header
+from werkzeug.serving import WSGIRequestHandler
+import atexit
+import gzip
+import hashlib
+import math
+import orjson
+import os
+import queue
+import sys
+import threading
+import time
+from collections import deque
+from itertools import islice
+from pathlib import Path
+
+
+class OrjsonProvider(JSONProvider):
+    """Flask JSON provider backed by orjson"""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
+class GzipMiddleware:
+    """WSGI middleware that gzips HTML/JSON responses for clients that accept it
+
+    Only complete 200 responses with a Content-Length of at least
+    minimum_size bytes are compressed; streamed bodies pass through untouched.
+    The wrapped app must not use the legacy write() callable.
+    """
+
+    COMPRESSIBLE_TYPES = ('text/html', 'application/json')
+
+    def __init__(self, app, minimum_size=200, compresslevel=6):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.compresslevel = compresslevel
+
+    def __call__(self, environ, start_response):
+        captured = []
+
+        def capture_start_response(status, headers, exc_info=None):
+            captured[:] = [status, headers, exc_info]
+
+        app_iter = self.app(environ, capture_start_response)
+        status, headers, exc_info = captured
+        header_map = {name.lower(): value for name, value in headers}
+
+        if not header_map.get('content-type', '').startswith(self.COMPRESSIBLE_TYPES):
+            start_response(status, headers, exc_info)
+            return app_iter
+
+        headers.append(('Vary', 'Accept-Encoding'))
+        if not self._should_compress(environ, status, header_map):
+            start_response(status, headers, exc_info)
+            return app_iter
+
+        try:
+            body = gzip.compress(b''.join(app_iter), compresslevel=self.compresslevel)
+        finally:
+            if hasattr(app_iter, 'close'):
+                app_iter.close()
+        headers = [
+            # The gzip body differs byte-wise, so a strong ETag becomes weak
+            (name, 'W/' + value) if name.lower() == 'etag' and not value.startswith('W/') else (name, value)
+            for name, value in headers if name.lower() != 'content-length'
+        ]
+        headers.append(('Content-Encoding', 'gzip'))
+        headers.append(('Content-Length', str(len(body))))
+        start_response(status, headers, exc_info)
+        return [body]
+
+    def _should_compress(self, environ, status, header_map):
+        if parse_accept_header(environ.get('HTTP_ACCEPT_ENCODING'))['gzip'] <= 0:
+            return False
+        if environ.get('REQUEST_METHOD') == 'HEAD' or not status.startswith('200'):
+            return False
+        if 'content-encoding' in header_map:
+            return False
+        try:
+            return int(header_map.get('content-length', '')) >= self.minimum_size
+        except ValueError:
+            return False
+
+
+MAX_BODY_SIZE = 4096  # bytes; command and report bodies are tiny
 
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
+app.config['MAX_CONTENT_LENGTH'] = MAX_BODY_SIZE
+app.wsgi_app = GzipMiddleware(app.wsgi_app)
+
+
+class SPSCRing:
+    """Fixed-capacity FIFO ring buffer for the command path
+
+    The ESP8266 poll is the only consumer, so get() and size() take no lock;
+    the GIL makes each index update atomic. Producers (web UI request threads)
+    are serialized with a plain lock so two concurrent puts cannot claim the
+    same slot.
+    """
+
+    __slots__ = ('buf', 'mask', 'head', 'tail', '_put_lock')
+
+    def __init__(self, capacity):
+        assert capacity > 0 and capacity & (capacity - 1) == 0, "capacity must be a power of two"
+        self.buf = [None] * capacity
+        self.mask = capacity - 1
+        self.head = 0  # next slot to write
+        self.tail = 0  # next slot to read
+        self._put_lock = threading.Lock()
+
+    def put(self, item):
+        """Append an item; returns False if the ring is full"""
+        with self._put_lock:
+            if self.head - self.tail > self.mask:
+                return False
+            self.buf[self.head & self.mask] = item
+            self.head += 1
+        return True
+
+    def get(self):
+        """Pop the oldest item, or None if the ring is empty"""
+        if self.head == self.tail:
+            return None
+        index = self.tail & self.mask
+        item = self.buf[index]
+        self.buf[index] = None
+        self.tail += 1
+        return item
+
+    def size(self):
+        return self.head - self.tail
+
 
 # Command storage
-saved_commands = {}  # key: command_name, value: command_dict
-command_queue = Queue()
-current_command = None
-command_acknowledged = False
+COMMAND_QUEUE_SIZE = 64  # must be a power of two
+COMMAND_BATCH_SIZE = 8  # max commands handed to the ESP8266 per poll
+# Commands are stored as (command_dict, json_string) entries so each one is
+# serialized once, when it is queued or saved, not on every poll
+saved_commands = {}  # key: command_name, value: command entry
+saved_list_body = None  # cached /api/command/list response body; None when stale
+saved_lock = threading.Lock()  # guards saved_commands mutations and saved_list_body
+
+# Saved commands are persisted as an append-only journal of save/delete
+# records; writes are buffered and fsynced in batches by a background thread
+JOURNAL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'commands.log')
+JOURNAL_FLUSH_INTERVAL = 0.1  # seconds
+_journal_buffer = bytearray()
+_journal_lock = threading.Lock()  # guards _journal_buffer
+_journal_write_lock = threading.Lock()  # serializes writes to the journal file
+_journal_pending = threading.Event()  # set when _journal_buffer has data
+command_queue = SPSCRing(COMMAND_QUEUE_SIZE)
+current_batch = []  # entries sent to the ESP8266 but not yet acknowledged
+command_ready = threading.Event()  # set whenever a command is queued
+MAX_POLL_WAIT = 30  # seconds a long-poll on /api/command/get may block
 
-# Device logs
-device_logs = []
+# Command types handled by arduino_target.cpp; anything else is rejected
+# before it reaches the queue
+VALID_TYPES = frozenset(sys.intern(t) for t in ('blink', 'led_on', 'led_off', 'stop', 'ping', 'status'))
+
+# Device logs (newest first)
 MAX_LOGS = 100
+device_logs = deque(maxlen=MAX_LOGS)
+_ts_cache = [0, ""]  # [epoch second, '%H:%M:%S' string] for log timestamps
+log_changed = threading.Condition()  # notified on every new log entry
+log_count = 0  # total entries ever logged; lets streams tell what they missed
+LOG_STREAM_KEEPALIVE = 15  # seconds between idle /api/logs/stream messages
+LOG_STREAM_MAX_AGE = 60  # seconds before a stream ends and the browser reconnects
 
-# HTML Template for web interface
-HTML_TEMPLATE = """
-<!DOCTYPE html>
-<html>
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1">
-    <title>Arduino Command Center</title>
-    <style>
-        body {
-            font-family: Arial, sans-serif;
-            max-width: 1000px;
-            margin: 20px auto;
-            padding: 20px;
-            background: #f5f5f5;
-        }
-        .container {
-            background: white;
-            padding: 30px;
-            border-radius: 10px;
-            box-shadow: 0 2px 10px rgba(0,0,0,0.1);
-            margin-bottom: 20px;
-        }
-        h1 {
-            color: #00979D;
-            margin-top: 0;
-        }
-        .status {
-            padding: 15px;
-            margin: 20px 0;
-            border-radius: 5px;
-            background: #e3f2fd;
-        }
-        .button {
-            background: #00979D;
-            color: white;
-            padding: 12px 30px;
-            border: none;
-            border-radius: 5px;
-            cursor: pointer;
-            font-size: 16px;
-            margin: 5px;
-        }
-        .button:hover {
-            background: #007c82;
-        }
-        .button.danger {
-            background: #d32f2f;
-        }
-        .button.danger:hover {
-            background: #b71c1c;
-        }
-        .log {
-            background: #1e1e1e;
-            color: #d4d4d4;
-            padding: 15px;
-            border-radius: 5px;
-            font-family: 'Courier New', monospace;
-            font-size: 12px;
-            max-height: 400px;
-            overflow-y: auto;
-        }
-        .log-entry {
-            margin: 5px 0;
-            padding: 5px;
-            border-left: 3px solid #00979D;
-            padding-left: 10px;
-        }
-        .command-section {
-            background: #f9f9f9;
-            padding: 20px;
-            margin: 15px 0;
-            border-radius: 5px;
-            border: 2px solid #e0e0e0;
-        }
-        input[type="text"], input[type="number"] {
-            width: 200px;
-            padding: 10px;
-            margin: 5px;
-            border: 1px solid #ddd;
-            border-radius: 4px;
-        }
-        label {
-            font-weight: bold;
-            margin-right: 10px;
-        }
-        table {
-            width: 100%;
-            border-collapse: collapse;
-            margin-top: 10px;
-            background: white;
-        }
-        table th {
-            background: #00979D;
-            color: white;
-            padding: 10px;
-            text-align: left;
-            font-weight: bold;
-        }
-        table td {
-            padding: 8px;
-            border-bottom: 1px solid #ddd;
-        }
-        table tr:hover {
-            background: #f5f5f5;
-        }
-        code {
-            background: #f4f4f4;
-            padding: 2px 6px;
-            border-radius: 3px;
-            font-family: 'Courier New', monospace;
-            font-size: 11px;
-        }
-    </style>
-</head>
-<body>
-    <h1 style="text-align: center;">🎛️ Arduino R4 Command Center</h1>
-    
-    <div class="container">
-        <h2>💡 LED Blink Control</h2>
-        
-        <div class="command-section">
-            <h3>Pre-set Speeds</h3>
-            <button onclick="sendBlink(100)" class="button">Very Fast (100ms)</button>
-            <button onclick="sendBlink(250)" class="button">Fast (250ms)</button>
-            <button onclick="sendBlink(500)" class="button">Normal (500ms)</button>
-            <button onclick="sendBlink(1000)" class="button">Slow (1 second)</button>
-            <button onclick="sendBlink(2000)" class="button">Very Slow (2 seconds)</button>
-        </div>
-        
-        <div class="command-section">
-            <h3>Custom Speed</h3>
-            <label>Blink Duration (ms):</label>
-            <input type="number" id="customDuration" value="500" min="50" max="5000">
-            <button onclick="sendCustomBlink()" class="button">Set Custom Speed</button>
-        </div>
-        
-        <div class="command-section">
-            <h3>LED Control</h3>
-            <button onclick="sendCommand({type:'led_on'})" class="button">LED ON</button>
-            <button onclick="sendCommand({type:'led_off'})" class="button">LED OFF</button>
-            <button onclick="sendCommand({type:'stop'})" class="button danger">Stop Blinking</button>
-        </div>
-    </div>
-    
-    <div class="container">
-        <h2>💾 Saved Commands</h2>
-        <div class="command-section">
-            <h3>Save Current Command</h3>
-            <label>Command Name:</label>
-            <input type="text" id="saveName" placeholder="e.g., fast_blink">
-            <button onclick="saveCommand()" class="button">Save Last Command</button>
-        </div>
-        
-        <div class="command-section">
-            <h3>Load & Send Saved Commands</h3>
-            <div id="savedCommandsList">
-                <p>No saved commands yet...</p>
-            </div>
-        </div>
-    </div>
-    
-    <div class="container">
-        <h2>⚙️ System Control</h2>
-        <button onclick="pingArduino()" class="button">Ping Arduino</button>
-        <button onclick="getStatus()" class="button">Get Status</button>
-        <button onclick="clearLogs()" class="button">Clear Logs</button>
-    </div>
-    
-    <div class="container">
-        <h2>📊 Device Log</h2>
-        <div class="status">
-            Queue: <span id="queueSize">0</span> commands | 
-            Last Update: <span id="lastUpdate">-</span>
-        </div>
-        <div class="log" id="deviceLog">
-            <div class="log-entry">Waiting for device connection...</div>
-        </div>
-    </div>
-
-    <script>
-        let lastCommand = null;
-        
-        function sendCommand(command) {
-            lastCommand = command;
-            fetch('/api/command/send', {
-                method: 'POST',
-                headers: {'Content-Type': 'application/json'},
-                body: JSON.stringify(command)
-            })
-            .then(r => r.json())
-            .then(data => {
-                console.log('Command sent:', data);
-                document.getElementById('queueSize').textContent = data.queue_size;
-                addLog('✓ Command queued: ' + command.type);
-            })
-            .catch(err => {
-                console.error('Error:', err);
-                addLog('✗ Error: ' + err.message);
-            });
-        }
-        
-        function sendBlink(duration) {
-            sendCommand({
-                type: 'blink',
-                duration: duration
-            });
-        }
-        
-        function sendCustomBlink() {
-            const duration = parseInt(document.getElementById('customDuration').value);
-            if (duration >= 50 && duration <= 5000) {
-                sendBlink(duration);
-            } else {
-                alert('Duration must be between 50 and 5000 ms');
-            }
-        }
-        
-        function saveCommand() {
-            const name = document.getElementById('saveName').value.trim();
-            if (!name) {
-                alert('Please enter a command name');
-                return;
-            }
-            if (!lastCommand) {
-                alert('No command to save. Send a command first!');
-                return;
-            }
-            
-            fetch('/api/command/save', {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({name: name, command: lastCommand})
-            })
-            .then(r => r.json())
-            .then(data => {
-                addLog('✓ ' + data.message);
-                document.getElementById('saveName').value = '';
-                loadSavedCommands();
-            })
-            .catch(err => {
-                addLog('✗ Error saving command: ' + err.message);
-            });
-        }
-        
-        function loadSavedCommands() {
-            fetch('/api/command/list')
-            .then(r => r.json())
-            .then(data => {
-                const listDiv = document.getElementById('savedCommandsList');
-                if (Object.keys(data.commands).length === 0) {
-                    listDiv.innerHTML = '<p>No saved commands yet...</p>';
-                } else {
-                    let html = '<table style="width:100%; border-collapse: collapse;">';
-                    html += '<tr><th>Name</th><th>Command</th><th>Actions</th></tr>';
-                    for (const [name, cmd] of Object.entries(data.commands)) {
-                        html += `<tr>
-                            <td><strong>${name}</strong></td>
-                            <td><code>${JSON.stringify(cmd)}</code></td>
-                            <td>
-                                <button onclick="executeCommand('${name}')" class="button" style="margin:2px; font-size:12px;">Send</button>
-                                <button onclick="deleteCommand('${name}')" class="button danger" style="margin:2px; font-size:12px;">Delete</button>
-                            </td>
-                        </tr>`;
-                    }
-                    html += '</table>';
-                    listDiv.innerHTML = html;
-                }
-            })
-            .catch(err => console.error('Failed to load saved commands:', err));
-        }
-        
-        function executeCommand(name) {
-            fetch('/api/command/execute', {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({name: name})
-            })
-            .then(r => r.json())
-            .then(data => {
-                addLog('✓ ' + data.message);
-                document.getElementById('queueSize').textContent = data.queue_size;
-            })
-            .catch(err => {
-                addLog('✗ Error executing command: ' + err.message);
-            });
-        }
-        
-        function deleteCommand(name) {
-            if (!confirm(`Delete command "${name}"?`)) return;
-            
-            fetch('/api/command/delete', {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({name: name})
-            })
-            .then(r => r.json())
-            .then(data => {
-                addLog('✓ ' + data.message);
-                loadSavedCommands();
-            })
-            .catch(err => {
-                addLog('✗ Error deleting command: ' + err.message);
-            });
-        }
-        
-        function pingArduino() {
-            sendCommand({type: 'ping'});
-        }
-        
-        function getStatus() {
-            sendCommand({type: 'status'});
-        }
-        
-        function addLog(message) {
-            const log = document.getElementById('deviceLog');
-            const entry = document.createElement('div');
-            entry.className = 'log-entry';
-            entry.textContent = new Date().toLocaleTimeString() + ' - ' + message;
-            log.insertBefore(entry, log.firstChild);
-            
-            while (log.children.length > 50) {
-                log.removeChild(log.lastChild);
-            }
-            
-            document.getElementById('lastUpdate').textContent = new Date().toLocaleTimeString();
-        }
-        
-        function clearLogs() {
-            document.getElementById('deviceLog').innerHTML = '<div class="log-entry">Logs cleared</div>';
-        }
-        
-        // Auto-refresh saved commands every 5 seconds
-        setInterval(loadSavedCommands, 5000);
-        
-        // Initial load
-        loadSavedCommands();
-        }
-        
-        // Poll for log updates
-        setInterval(() => {
-            fetch('/api/logs/get')
-                .then(r => r.json())
-                .then(data => {
-                    if (data.logs && data.logs.length > 0) {
-                        const log = document.getElementById('deviceLog');
-                        log.innerHTML = '';
-                        data.logs.forEach(entry => {
-                            const div = document.createElement('div');
-                            div.className = 'log-entry';
-                            div.textContent = entry;
-                            log.appendChild(div);
-                        });
-                    }
-                    document.getElementById('queueSize').textContent = data.queue_size || 0;
-                });
-        }, 2000);
-    </script>
-</body>
-</html>
-"""
+# Console lines are written by a background thread so request handlers
+# never block on stdout
+_print_queue = queue.SimpleQueue()
+
+# Web interface (server/templates/index.html) has no template variables, so
+# read it once and let browsers cache it
+_HTML_BYTES = (Path(__file__).parent / 'templates' / 'index.html').read_bytes()
+_HTML_ETAG = hashlib.md5(_HTML_BYTES).hexdigest()
+# Compressed once at maximum level instead of per request by GzipMiddleware
+_HTML_GZIP = gzip.compress(_HTML_BYTES, compresslevel=9)
+
+
+def _command_entry(command):
+    """Pair a command with its compact JSON encoding"""
+    return (command, orjson.dumps(command).decode('utf-8'))
+
+
+def _json_response(obj, status=200):
+    """Serialize obj with orjson into an application/json response"""
+    return Response(orjson.dumps(obj), status=status, mimetype='application/json')
+
+
+# Body of the fixed {'success': True} reply sent on every ack and device report
+_OK_BODY = b'{"success":true}'
+_OK_LENGTH = str(len(_OK_BODY))
+
+
+def _ok_response():
+    """Fixed {'success': true} reply, built without any JSON encoding"""
+    response = Response(_OK_BODY, mimetype='application/json', direct_passthrough=True)
+    response.headers['Content-Length'] = _OK_LENGTH
+    return response
+
+
+def _json_body(allow_empty=False):
+    """Decode the request body once with orjson
+
+    Bodies over MAX_BODY_SIZE are a 413; malformed JSON, or JSON that is
+    not an object, is a 400. With allow_empty, an empty body decodes as {}.
+    """
+    body = request.get_data(cache=False, parse_form_data=False)
+    if len(body) > MAX_BODY_SIZE:
+        abort(413)
+    if allow_empty and not body:
+        return {}
+    try:
+        data = orjson.loads(body)
+    except orjson.JSONDecodeError:
+        abort(400, description='Request body must be valid JSON')
+    if not isinstance(data, dict):
+        abort(400, description='Request body must be a JSON object')
+    return data
+
+
+def _name_field(data):
+    """Stripped 'name' from a request body, or '' if it is missing or not a string"""
+    name = data.get('name')
+    return name.strip() if isinstance(name, str) else ''
+
+
+def _poll_wait():
+    """Seconds from ?wait=N, clamped to 0..MAX_POLL_WAIT; NaN/inf count as 0"""
+    wait = request.args.get('wait', 0, type=float)
+    if not math.isfinite(wait):
+        return 0
+    return min(max(wait, 0), MAX_POLL_WAIT)
+
+
+def _command_type(command):
+    """Return the interned type of a command, or None if it is not valid"""
+    if not isinstance(command, dict):
+        return None
+    command_type = command.get('type')
+    if not isinstance(command_type, str) or command_type not in VALID_TYPES:
+        return None
+    return sys.intern(command_type)
+
+
+def _print_drain():
+    """Write queued console lines to stdout, one write and flush per batch"""
+    while True:
+        batch = [_print_queue.get()]
+        while True:
+            try:
+                batch.append(_print_queue.get_nowait())
+            except queue.Empty:
+                break
+        sys.stdout.write(''.join(batch))
+        sys.stdout.flush()
+
+
+threading.Thread(target=_print_drain, name='print-drain', daemon=True).start()
+
+
+def _print(message):
+    """Queue a console line for the drain thread"""
+    _print_queue.put(message + '\n')
+
+
+def _ts():
+    """Current '%H:%M:%S' time, reformatted only when the second changes"""
+    now = int(time.time())
+    if now != _ts_cache[0]:
+        _ts_cache[0] = now
+        _ts_cache[1] = time.strftime('%H:%M:%S', time.localtime(now))
+    return _ts_cache[1]
+
+
+def _log(message):
+    """Add a timestamped entry to the front of the device log"""
+    global log_count
+    entry = "%s - %s" % (_ts(), message)
+    with log_changed:
+        device_logs.appendleft(entry)
+        log_count += 1
+        log_changed.notify_all()
+
+
+def _log_events():
+    """Server-Sent Events for /api/logs/stream
+
+    Sends a 'snapshot' event with the newest 50 entries, then one message per
+    wake-up carrying just the entries added since (newest first). Idle
+    streams get an empty message every LOG_STREAM_KEEPALIVE seconds, which
+    refreshes the queue size and lets a dead client be noticed.
+    
+    Each open stream holds a server thread, so streams end after
+    LOG_STREAM_MAX_AGE seconds; EventSource reconnects (told to retry after
+    one second) and gets a fresh snapshot. This bounds how long a stream
+    from a closed tab can linger.
+    """
+    deadline = time.monotonic() + LOG_STREAM_MAX_AGE
+    with log_changed:
+        seen = log_count
+        logs = list(islice(device_logs, 50))
+    yield 'retry: 1000\nevent: snapshot\ndata: %s\n\n' % orjson.dumps({
+        'logs': logs,
+        'queue_size': command_queue.size()
+    }).decode('utf-8')
+    
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+        with log_changed:
+            log_changed.wait_for(lambda: log_count != seen,
+                                 timeout=min(LOG_STREAM_KEEPALIVE, remaining))
+            logs = list(islice(device_logs, min(log_count - seen, MAX_LOGS)))
+            seen = log_count
+        yield 'data: %s\n\n' % orjson.dumps({
+            'logs': logs,
+            'queue_size': command_queue.size()
+        }).decode('utf-8')
+
+
+def _load_journal():
+    """Rebuild saved_commands from the journal and compact it
+
+    Lines that fail to parse (e.g. a record cut short by a crash) are skipped.
+    The journal is then rewritten with one save record per surviving command.
+    """
+    try:
+        with open(JOURNAL_PATH, 'rb') as journal:
+            for line in journal:
+                try:
+                    record = orjson.loads(line)
+                except orjson.JSONDecodeError:
+                    continue
+                if not isinstance(record, dict) or not isinstance(record.get('name'), str):
+                    continue
+                if record.get('op') == 'save':
+                    saved_commands[record['name']] = _command_entry(record.get('cmd'))
+                elif record.get('op') == 'delete':
+                    saved_commands.pop(record['name'], None)
+    except FileNotFoundError:
+        return
+    
+    compact_path = JOURNAL_PATH + '.tmp'
+    with open(compact_path, 'wb') as journal:
+        for name, entry in saved_commands.items():
+            journal.write(orjson.dumps({'op': 'save', 'name': name, 'cmd': entry[0]}) + b'\n')
+        journal.flush()
+        os.fsync(journal.fileno())
+    os.replace(compact_path, JOURNAL_PATH)
+
+
+def _journal_append(record):
+    """Buffer a journal record; the writer thread persists it shortly after"""
+    with _journal_lock:
+        _journal_buffer.extend(orjson.dumps(record))
+        _journal_buffer.extend(b'\n')
+    _journal_pending.set()
+
+
+def _flush_journal():
+    """Write and fsync everything buffered so far"""
+    with _journal_write_lock:
+        with _journal_lock:
+            data = bytes(_journal_buffer)
+            _journal_buffer.clear()
+            _journal_pending.clear()
+        if data:
+            _journal_file.write(data)
+            os.fsync(_journal_file.fileno())
+
+
+def _journal_writer():
+    """Flush the journal at most once per JOURNAL_FLUSH_INTERVAL while busy"""
+    while True:
+        _journal_pending.wait()
+        time.sleep(JOURNAL_FLUSH_INTERVAL)  # let concurrent saves share one fsync
+        _flush_journal()
+
+
+_load_journal()
+_journal_file = open(JOURNAL_PATH, 'ab', buffering=0)
+threading.Thread(target=_journal_writer, name='journal-writer', daemon=True).start()
+atexit.register(_flush_journal)
 
 
 @app.route('/')
 def index():
     """Web interface"""
-    return render_template_string(HTML_TEMPLATE)
+    if request.accept_encodings['gzip'] > 0:
+        response = Response(_HTML_GZIP, mimetype='text/html')
+        response.headers['Content-Encoding'] = 'gzip'
+        response.set_etag(_HTML_ETAG, weak=True)
+    else:
+        response = Response(_HTML_BYTES, mimetype='text/html')
+        response.set_etag(_HTML_ETAG)
+    response.headers['Cache-Control'] = 'public, max-age=300'
+    return response.make_conditional(request)
 
 
 @app.route('/api/command/send', methods=['POST'])
 def send_command():
     """Queue a command to be sent to Arduino"""
-    command = request.json
+    command = _json_body()
+    command_type = _command_type(command)
+    if command_type is None:
+        return _json_response({'success': False, 'message': 'Unknown command type'}, 400)
     
     # Add to queue
-    command_queue.put(command)
+    if not command_queue.put(_command_entry(command)):
+        return _json_response({'success': False, 'message': 'Command queue is full'}, 503)
+    command_ready.set()
     
-    log_message = f"Command queued: {command.get('type', 'unknown')}"
-    device_logs.insert(0, f"{datetime.now().strftime('%H:%M:%S')} - {log_message}")
-    if len(device_logs) > MAX_LOGS:
-        device_logs.pop()
+    log_message = "Command queued: %s" % command_type
+    _log(log_message)
     
-    print(f"📨 {log_message}")
+    _print(f"📨 {log_message}")
     
-    return jsonify({
+    return _json_response({
         'success': True,
         'message': 'Command queued',
-        'queue_size': command_queue.qsize()
+        'queue_size': command_queue.size()
     })
 
 
 @app.route('/api/command/get', methods=['GET'])
 def get_command():
-    """ESP8266 polls this to get the next command"""
-    global current_command, command_acknowledged
-    
-    # If there's a current command that hasn't been acknowledged, return it again
-    if current_command and not command_acknowledged:
-        return jsonify({
-            'has_command': True,
-            'command': json.dumps(current_command)
-        })
-    
-    # Get next command from queue
-    if not command_queue.empty():
-        current_command = command_queue.get()
-        command_acknowledged = False
-        
-        print(f"📤 Sending command to ESP8266: {current_command.get('type', 'unknown')}")
-        
-        return jsonify({
+    """ESP8266 polls this to get the next batch of commands
+
+    Unacknowledged commands are returned again, topped up from the queue
+    to at most COMMAND_BATCH_SIZE. 'command' holds the first entry of
+    'commands' for firmware that handles one command per poll.
+
+    With ?wait=N the request blocks for up to N seconds (capped at
+    MAX_POLL_WAIT) until a command is queued, instead of returning
+    immediately with has_command false.
+    """
+    wait = _poll_wait()
+    if wait and not current_batch:
+        # Clear before checking so a put() between the check and the wait
+        # still wakes us
+        command_ready.clear()
+        if not command_queue.size():
+            command_ready.wait(timeout=wait)
+    
+    while len(current_batch) < COMMAND_BATCH_SIZE:
+        entry = command_queue.get()
+        if entry is None:
+            break
+        current_batch.append(entry)
+        _print(f"📤 Sending command to ESP8266: {entry[0].get('type', 'unknown')}")
+    
+    if current_batch:
+        commands = [entry[1] for entry in current_batch]
+        return _json_response({
             'has_command': True,
-            'command': json.dumps(current_command)
+            'command': commands[0],
+            'commands': commands,
+            'count': len(commands)
         })
     
-    return jsonify({'has_command': False})
+    return _json_response({'has_command': False})
 
 
 @app.route('/api/command/ack', methods=['POST'])
 def acknowledge_command():
-    """ESP8266 acknowledges command was sent to Arduino"""
-    global command_acknowledged
-    
-    command_acknowledged = True
-    print("✅ Command acknowledged by ESP8266")
-    
-    return jsonify({'success': True})
+    """ESP8266 acknowledges commands were sent to Arduino
+
+    Body {"count": n} acknowledges the first n commands of the last batch;
+    an empty body acknowledges one, as sent by older firmware.
+    """
+    data = _json_body(allow_empty=True)
+    try:
+        count = int(data.get('count', 1))
+    except (TypeError, ValueError):
+        return _json_response({'success': False, 'message': 'count must be an integer'}, 400)
+    
+    count = max(0, min(count, len(current_batch)))
+    del current_batch[:count]
+    _print(f"✅ {count} command(s) acknowledged by ESP8266")
+    
+    return _ok_response()
 
 
 @app.route('/api/device/report', methods=['POST'])
 def device_report():
     """ESP8266 reports status and Arduino responses"""
-    data = request.json
+    data = _json_body()
     device_id = data.get('device_id', 'Unknown')
     status = data.get('status', 'Unknown')
     message = data.get('message', '')
     
-    log_message = f"[{device_id}] {status}: {message}"
-    device_logs.insert(0, f"{datetime.now().strftime('%H:%M:%S')} - {log_message}")
-    if len(device_logs) > MAX_LOGS:
-        device_logs.pop()
+    log_message = "[%s] %s: %s" % (device_id, status, message)
+    _log(log_message)
     
-    print(f"📡 {log_message}")
+    _print(f"📡 {log_message}")
     
-    return jsonify({'success': True})
+    return _ok_response()
 
 
 @app.route('/api/logs/get', methods=['GET'])
 def get_logs():
     """Get recent device logs"""
-    return jsonify({
-        'logs': device_logs[:50],
-        'queue_size': command_queue.qsize()
+    return _json_response({
+        'logs': list(islice(device_logs, 50)),
+        'queue_size': command_queue.size()
     })
 
 
+@app.route('/api/logs/stream', methods=['GET'])
+def stream_logs():
+    """Push device log updates to the web UI as Server-Sent Events"""
+    response = Response(_log_events(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # don't let a reverse proxy buffer events
+    return response
+
+
 @app.route('/api/command/save', methods=['POST'])
 def save_command():
     """Save a command for later use"""
-    data = request.json
-    name = data.get('name', '').strip()
+    global saved_list_body
+    
+    data = _json_body()
+    name = _name_field(data)
     command = data.get('command')
     
     if not name:
-        return jsonify({'success': False, 'message': 'Command name is required'}), 400
+        return _json_response({'success': False, 'message': 'Command name is required'}, 400)
     
     if not command:
-        return jsonify({'success': False, 'message': 'Command data is required'}), 400
+        return _json_response({'success': False, 'message': 'Command data is required'}, 400)
+    
+    if _command_type(command) is None:
+        return _json_response({'success': False, 'message': 'Unknown command type'}, 400)
     
-    saved_commands[name] = command
+    entry = _command_entry(command)
+    with saved_lock:
+        saved_commands[name] = entry
+        saved_list_body = None
+        _journal_append({'op': 'save', 'name': name, 'cmd': command})
     
-    log_message = f"Command saved: {name}"
-    device_logs.insert(0, f"{datetime.now().strftime('%H:%M:%S')} - {log_message}")
-    if len(device_logs) > MAX_LOGS:
-        device_logs.pop()
+    log_message = "Command saved: %s" % name
+    _log(log_message)
     
-    print(f"💾 {log_message} -> {command}")
+    _print(f"💾 {log_message} -> {command}")
     
-    return jsonify({
+    return _json_response({
         'success': True,
         'message': f'Command "{name}" saved successfully'
     })
@@ -508,62 +570,76 @@ def save_command():
 @app.route('/api/command/list', methods=['GET'])
 def list_commands():
     """List all saved commands"""
-    return jsonify({
-        'commands': saved_commands
-    })
+    global saved_list_body
+    # The UI polls this every few seconds; only re-encode after a save/delete
+    body = saved_list_body
+    if body is None:
+        with saved_lock:
+            if saved_list_body is None:
+                saved_list_body = orjson.dumps({
+                    'commands': {name: entry[0] for name, entry in saved_commands.items()}
+                })
+            body = saved_list_body
+    return Response(body, mimetype='application/json')
 
 
 @app.route('/api/command/execute', methods=['POST'])
 def execute_command():
     """Execute a saved command by name (adds to queue)"""
-    data = request.json
-    name = data.get('name', '').strip()
+    data = _json_body()
+    name = _name_field(data)
     
     if not name:
-        return jsonify({'success': False, 'message': 'Command name is required'}), 400
+        return _json_response({'success': False, 'message': 'Command name is required'}, 400)
     
-    if name not in saved_commands:
-        return jsonify({'success': False, 'message': f'Command "{name}" not found'}), 404
+    # A single get() so a concurrent delete can't land between check and read
+    entry = saved_commands.get(name)
+    if entry is None:
+        return _json_response({'success': False, 'message': f'Command "{name}" not found'}, 404)
     
-    command = saved_commands[name]
-    command_queue.put(command)
+    command = entry[0]
+    if not command_queue.put(entry):
+        return _json_response({'success': False, 'message': 'Command queue is full'}, 503)
+    command_ready.set()
     
-    log_message = f'Executing saved command: {name} ({command.get("type", "unknown")})'
-    device_logs.insert(0, f"{datetime.now().strftime('%H:%M:%S')} - {log_message}")
-    if len(device_logs) > MAX_LOGS:
-        device_logs.pop()
+    log_message = "Executing saved command: %s (%s)" % (name, command.get('type', 'unknown'))
+    _log(log_message)
     
-    print(f"▶️  {log_message}")
+    _print(f"▶️  {log_message}")
     
-    return jsonify({
+    return _json_response({
         'success': True,
         'message': f'Command "{name}" added to queue',
-        'queue_size': command_queue.qsize()
+        'queue_size': command_queue.size()
     })
 
 
 @app.route('/api/command/delete', methods=['POST'])
 def delete_command():
     """Delete a saved command"""
-    data = request.json
-    name = data.get('name', '').strip()
+    global saved_list_body
+    
+    data = _json_body()
+    name = _name_field(data)
     
     if not name:
-        return jsonify({'success': False, 'message': 'Command name is required'}), 400
+        return _json_response({'success': False, 'message': 'Command name is required'}, 400)
     
-    if name not in saved_commands:
-        return jsonify({'success': False, 'message': f'Command "{name}" not found'}), 404
+    with saved_lock:
+        deleted_entry = saved_commands.pop(name, None)
+        if deleted_entry is not None:
+            saved_list_body = None
+            _journal_append({'op': 'delete', 'name': name})
     
-    deleted_cmd = saved_commands.pop(name)
+    if deleted_entry is None:
+        return _json_response({'success': False, 'message': f'Command "{name}" not found'}, 404)
     
-    log_message = f'Deleted saved command: {name}'
-    device_logs.insert(0, f"{datetime.now().strftime('%H:%M:%S')} - {log_message}")
-    if len(device_logs) > MAX_LOGS:
-        device_logs.pop()
+    log_message = "Deleted saved command: %s" % name
+    _log(log_message)
     
-    print(f"🗑️  {log_message}")
+    _print(f"🗑️  {log_message}")
     
-    return jsonify({
+    return _json_response({
         'success': True,
         'message': f'Command "{name}" deleted successfully'
     })
@@ -576,7 +652,12 @@ if __name__ == '__main__':
     print(f"🌐 Server starting on http://0.0.0.0:3000")
     print(f"💡 Web interface: http://localhost:3000")
     print(f"🔌 ESP8266 polls: http://<your-pc-ip>:3000/api/command/get")
+    print("🚀 Production: gunicorn -w 1 --threads 16 --keep-alive 75 -b 0.0.0.0:3000 wsgi:application")
     print("=" * 60)
     print("")
     
-    app.run(host='0.0.0.0', port=3000, debug=True)
+    # Development server only; see wsgi.py for running under gunicorn.
+    # HTTP/1.1 allows chunked streaming for /api/logs/stream. Werkzeug still
+    # closes every connection, so keep-alive between polls needs gunicorn.
+    WSGIRequestHandler.protocol_version = 'HTTP/1.1'
+    app.run(host='0.0.0.0', port=3000, threaded=True)
@@ -4,22 +4,122 @@ Arduino Command Center - Server with Command Queue
 Stores commands to be sent to Arduino via ESP8266
 """
 
-from flask import Flask, jsonify, request, render_template_string
+from flask import Flask, Response, abort, request
+from flask.json.provider import JSONProvider
+import hashlib
+import math
+import orjson
 import socket
+import threading
+import time
+from collections import OrderedDict, deque
 from datetime import datetime
+from pathlib import Path
+
+class OrjsonProvider(JSONProvider):
+    """Flask JSON provider backed by orjson"""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
 
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
+
+# The queue and command library are per-process, in-memory state: run this
+# server as a single process (threads are fine). Extra worker processes
+# would each get their own queue, and a restart drops pending commands.
+#
+# In production run it under gunicorn with one gevent worker, which keeps
+# many long-polling ESP8266s waiting on a single process, and holds idle
+# connections open so the ESP8266 can reuse them between polls:
+#   gunicorn -k gevent -w 1 --worker-connections 1000 --keep-alive 60 -b 0.0.0.0:5001 firmware_server_simple:app
 
 # Command queue - stores commands to be sent to Arduino
-command_queue = []
+MAX_QUEUE = 10000  # pending commands; once full, new ones get a 503
+command_queue = deque(maxlen=MAX_QUEUE)
+_queue_lock = threading.Lock()  # request handlers run on separate threads
+_queue_ready = threading.Condition(_queue_lock)  # notified when a command is queued
+MAX_BATCH = 16  # most commands handed out by one /api/command/get?max=N
+MAX_POLL_WAIT = 30  # seconds a long-poll (?wait=N) may block
+
+# Web interface. In production nginx serves static/index.html directly (see
+# nginx-simple.conf); the / route below is the fallback for running bare.
+_INDEX_HTML = (Path(__file__).parent / 'static' / 'index.html').read_bytes()
+_INDEX_ETAG = hashlib.sha256(_INDEX_HTML).hexdigest()
+
+# Saved commands library, least recently used first
+MAX_SAVED = 1024  # saving past this evicts the least recently used command
+saved_commands = OrderedDict()
+_saved_lock = threading.Lock()
+
+_ts_cache = [-1, '']  # [epoch millisecond, isoformat string] of the last timestamp
+
+def now_iso():
+    """Current local time in isoformat, reused within the same millisecond
+
+    Keyed on the millisecond itself rather than time elapsed, so a clock
+    stepped backwards refreshes the cache instead of freezing it.
+    """
+    t = time.time()
+    ms = int(t * 1000)
+    if ms != _ts_cache[0]:
+        _ts_cache[1] = datetime.fromtimestamp(t).isoformat()
+        _ts_cache[0] = ms
+    return _ts_cache[1]
+
+def ojsonify(obj, status=200):
+    """Like jsonify, but serialized with orjson"""
+    return Response(orjson.dumps(obj), status=status, mimetype='application/json')
+
+def parse_json():
+    """Decode the request body with orjson; an empty body is {}
+
+    Malformed JSON, or JSON that is not an object, is a 400.
+    """
+    try:
+        data = orjson.loads(request.get_data(cache=False) or b'{}')
+    except orjson.JSONDecodeError:
+        abort(400, description='Request body must be valid JSON')
+    if not isinstance(data, dict):
+        abort(400, description='Request body must be a JSON object')
+    return data
+
+def poll_wait():
+    """Seconds from ?wait=N, clamped to 0..MAX_POLL_WAIT; NaN/inf count as 0"""
+    wait = request.args.get('wait', 0, type=float)
+    if not math.isfinite(wait):
+        return 0
+    return min(max(wait, 0), MAX_POLL_WAIT)
 
-# Saved commands library
-saved_commands = {}
+def prebuilt_response(obj, status=200):
+    """Encode a constant JSON reply once; returns a factory for fresh Responses"""
+    body = orjson.dumps(obj)
+    return lambda: Response(body, status=status, mimetype='application/json')
+
+# Commands sent by the web UI's Quick Actions buttons
+QUICK_COMMANDS = ('BLINK_FAST', 'BLINK_SLOW', 'LED_ON', 'LED_OFF', 'STOP', 'STATUS')
+# {'status': 'queued', 'command': ...} reply for each of them
+_QUICK_QUEUED = {name: prebuilt_response({'status': 'queued', 'command': name})
+                 for name in QUICK_COMMANDS}
+
+# Constant error replies
+_ERR_NO_COMMAND = prebuilt_response(
+    {'status': 'error', 'message': 'No command provided'}, 400)
+_ERR_NAME_AND_COMMAND = prebuilt_response(
+    {'status': 'error', 'message': 'Name and command required'}, 400)
+_ERR_NOT_FOUND = prebuilt_response(
+    {'status': 'error', 'message': 'Command not found'}, 404)
+# Sent when the queue is full, so clients back off instead of losing commands
+_ERR_QUEUE_FULL = prebuilt_response(
+    {'status': 'error', 'message': 'Command queue is full'}, 503)
 
 @app.route('/ping')
 def ping():
     """Simple ping endpoint to test connectivity"""
-    return jsonify({
+    return ojsonify({
         'status': 'ok',
         'message': 'pong'
     })
@@ -27,219 +127,131 @@ def ping():
 @app.route('/')
 def index():
     """Root endpoint with web interface"""
-    return render_template_string(HTML_TEMPLATE)
+    resp = Response(_INDEX_HTML, mimetype='text/html')
+    resp.set_etag(_INDEX_ETAG)
+    resp.cache_control.public = True
+    resp.cache_control.max_age = 3600
+    return resp.make_conditional(request)
 
 @app.route('/api/command/get', methods=['GET'])
 def get_command():
-    """ESP8266 polls this to get next command for Arduino"""
-    if command_queue:
-        cmd = command_queue.pop(0)
-        return jsonify({
+    """ESP8266 polls this to get next command for Arduino
+
+    With ?max=N, up to N queued commands (capped at MAX_BATCH) are returned
+    as {'commands': [...]}; without it the response is a single
+    {'command': ..., 'timestamp': ...} as before.
+
+    With ?wait=N the request blocks for up to N seconds (capped at
+    MAX_POLL_WAIT) until a command is queued, instead of returning an
+    empty response straight away.
+    """
+    max_n = request.args.get('max', type=int)
+    wait = poll_wait()
+    
+    if max_n is not None:
+        max_n = min(max(max_n, 1), MAX_BATCH)
+        out = []
+        with _queue_ready:
+            if wait:
+                _queue_ready.wait_for(lambda: command_queue, timeout=wait)
+            for _ in range(max_n):
+                if not command_queue:
+                    break
+                out.append(command_queue.popleft())
+        return ojsonify({'commands': out})
+    
+    with _queue_ready:
+        if wait:
+            _queue_ready.wait_for(lambda: command_queue, timeout=wait)
+        cmd = command_queue.popleft() if command_queue else None
+    if cmd:
+        return ojsonify({
             'command': cmd['command'],
             'timestamp': cmd['timestamp']
         })
-    return jsonify({'command': None})
+    return ojsonify({'command': None})
 
 @app.route('/api/command/send', methods=['POST'])
 def send_command():
     """Web UI sends commands here to queue for Arduino"""
-    data = request.json
+    data = parse_json()
     command = data.get('command', '')
     
     if command:
-        command_queue.append({
-            'command': command,
-            'timestamp': datetime.now().isoformat()
-        })
-        return jsonify({'status': 'queued', 'command': command})
-    return jsonify({'status': 'error', 'message': 'No command provided'}), 400
+        with _queue_ready:
+            if len(command_queue) == MAX_QUEUE:
+                return _ERR_QUEUE_FULL()
+            command_queue.append({
+                'command': command,
+                'timestamp': now_iso()
+            })
+            _queue_ready.notify()
+        reply = _QUICK_QUEUED.get(command) if isinstance(command, str) else None
+        if reply is not None:
+            return reply()
+        return ojsonify({'status': 'queued', 'command': command})
+    return _ERR_NO_COMMAND()
 
 @app.route('/api/command/save', methods=['POST'])
 def save_command():
     """Save a command to the library"""
-    data = request.json
+    data = parse_json()
     name = data.get('name', '')
     command = data.get('command', '')
     
-    if name and command:
-        saved_commands[name] = {
-            'command': command,
-            'saved_at': datetime.now().isoformat()
-        }
-        return jsonify({'status': 'saved', 'name': name})
-    return jsonify({'status': 'error', 'message': 'Name and command required'}), 400
+    # Names become JSON object keys in /api/command/list and URL segments
+    # in execute/delete, so only non-empty strings are accepted
+    if isinstance(name, str) and name and command:
+        with _saved_lock:
+            saved_commands[name] = {
+                'command': command,
+                'saved_at': now_iso()
+            }
+            saved_commands.move_to_end(name)
+            if len(saved_commands) > MAX_SAVED:
+                saved_commands.popitem(last=False)
+        return ojsonify({'status': 'saved', 'name': name})
+    return _ERR_NAME_AND_COMMAND()
 
 @app.route('/api/command/list', methods=['GET'])
 def list_saved_commands():
-    """Get all saved commands"""
-    return jsonify(saved_commands)
+    """Get all saved commands, sorted by name
+
+    saved_commands is kept in recency order for eviction; sorting keeps the
+    list the UI shows stable when a command is executed or re-saved.
+    """
+    with _saved_lock:
+        body = orjson.dumps(saved_commands, option=orjson.OPT_SORT_KEYS)
+    return Response(body, mimetype='application/json')
 
 @app.route('/api/command/execute/<name>', methods=['POST'])
 def execute_saved_command(name):
     """Execute a saved command by name"""
-    if name in saved_commands:
-        cmd = saved_commands[name]['command']
-        command_queue.append({
-            'command': cmd,
-            'timestamp': datetime.now().isoformat()
-        })
-        return jsonify({'status': 'queued', 'command': cmd})
-    return jsonify({'status': 'error', 'message': 'Command not found'}), 404
+    with _saved_lock:
+        entry = saved_commands.get(name)
+        if entry is not None:
+            saved_commands.move_to_end(name)
+    if entry is not None:
+        cmd = entry['command']
+        with _queue_ready:
+            if len(command_queue) == MAX_QUEUE:
+                return _ERR_QUEUE_FULL()
+            command_queue.append({
+                'command': cmd,
+                'timestamp': now_iso()
+            })
+            _queue_ready.notify()
+        return ojsonify({'status': 'queued', 'command': cmd})
+    return _ERR_NOT_FOUND()
 
 @app.route('/api/command/delete/<name>', methods=['DELETE'])
 def delete_saved_command(name):
     """Delete a saved command"""
-    if name in saved_commands:
-        del saved_commands[name]
-        return jsonify({'status': 'deleted', 'name': name})
-    return jsonify({'status': 'error', 'message': 'Command not found'}), 404
-
-# Simple HTML interface
-HTML_TEMPLATE = '''
-<!DOCTYPE html>
-<html>
-<head>
-    <title>Arduino Command Center</title>
-    <style>
-        body { font-family: Arial; margin: 20px; background: #f0f0f0; }
-        .container { max-width: 800px; margin: 0 auto; background: white; padding: 20px; border-radius: 8px; }
-        h1 { color: #333; }
-        .section { margin: 20px 0; padding: 15px; border: 1px solid #ddd; border-radius: 5px; }
-        input, button { padding: 10px; margin: 5px; font-size: 14px; }
-        button { background: #007bff; color: white; border: none; cursor: pointer; border-radius: 4px; }
-        button:hover { background: #0056b3; }
-        .btn-green { background: #28a745; }
-        .btn-green:hover { background: #218838; }
-        .btn-red { background: #dc3545; }
-        .btn-red:hover { background: #c82333; }
-        .btn-yellow { background: #ffc107; color: #333; }
-        .btn-yellow:hover { background: #e0a800; }
-        .btn-group { display: flex; gap: 10px; flex-wrap: wrap; }
-        .saved-cmd { background: #f8f9fa; padding: 10px; margin: 5px 0; border-radius: 4px; }
-        .delete-btn { background: #dc3545; }
-        .delete-btn:hover { background: #c82333; }
-        .status { padding: 10px; background: #e7f3ff; border-radius: 4px; margin: 10px 0; }
-    </style>
-</head>
-<body>
-    <div class="container">
-        <h1>🎛️ Arduino LED Control Center</h1>
-        
-        <div class="section">
-            <h2>⚡ Quick Actions</h2>
-            <div class="btn-group">
-                <button class="btn-yellow" onclick="sendQuick('BLINK_FAST')">💨 Blink Fast (200ms)</button>
-                <button class="btn-yellow" onclick="sendQuick('BLINK_SLOW')">🐌 Blink Slow (1000ms)</button>
-                <button class="btn-green" onclick="sendQuick('LED_ON')">💡 LED ON</button>
-                <button class="btn-red" onclick="sendQuick('LED_OFF')">🌑 LED OFF</button>
-                <button onclick="sendQuick('STOP')">⏹️ Stop Blink</button>
-                <button onclick="sendQuick('STATUS')">📊 Status</button>
-            </div>
-        </div>
-        
-        <div class="section">
-            <h2>Send Custom Command</h2>
-            <input type="text" id="cmdInput" placeholder="Enter command or JSON" style="width: 60%;">
-            <button onclick="sendCommand()">Send</button>
-            <div class="status">
-                <small>
-                    <b>Examples:</b><br>
-                    • BLINK_FAST, BLINK_SLOW<br>
-                    • LED_ON, LED_OFF, STOP<br>
-                    • {"type":"blink","duration":500}
-                </small>
-            </div>
-        </div>
-        
-        <div class="section">
-            <h2>Save Command</h2>
-            <input type="text" id="saveName" placeholder="Command name" style="width: 30%;">
-            <input type="text" id="saveCmd" placeholder="Command" style="width: 40%;">
-            <button onclick="saveCommand()">Save</button>
-        </div>
-        
-        <div class="section">
-            <h2>Saved Commands</h2>
-            <div id="savedList"></div>
-        </div>
-    </div>
-    
-    <script>
-        function sendQuick(cmd) {
-            fetch('/api/command/send', {
-                method: 'POST',
-                headers: {'Content-Type': 'application/json'},
-                body: JSON.stringify({command: cmd})
-            }).then(r => r.json()).then(d => {
-                console.log('✅ Queued:', d.command);
-            });
-        }
-        
-        function sendCommand() {
-            const cmd = document.getElementById('cmdInput').value;
-            fetch('/api/command/send', {
-                method: 'POST',
-                headers: {'Content-Type': 'application/json'},
-                body: JSON.stringify({command: cmd})
-            }).then(r => r.json()).then(d => {
-                alert('Command queued: ' + d.command);
-                document.getElementById('cmdInput').value = '';
-            });
-        }
-        
-        function saveCommand() {
-            const name = document.getElementById('saveName').value;
-            const cmd = document.getElementById('saveCmd').value;
-            fetch('/api/command/save', {
-                method: 'POST',
-                headers: {'Content-Type': 'application/json'},
-                body: JSON.stringify({name: name, command: cmd})
-            }).then(r => r.json()).then(d => {
-                alert('Command saved!');
-                document.getElementById('saveName').value = '';
-                document.getElementById('saveCmd').value = '';
-                loadSaved();
-            });
-        }
-        
-        function executeCommand(name) {
-            fetch('/api/command/execute/' + name, {method: 'POST'})
-            .then(r => r.json())
-            .then(d => console.log('✅ Executed:', d.command));
-        }
-        
-        function deleteCommand(name) {
-            if(confirm('Delete ' + name + '?')) {
-                fetch('/api/command/delete/' + name, {method: 'DELETE'})
-                .then(() => loadSaved());
-            }
-        }
-        
-        function loadSaved() {
-            fetch('/api/command/list')
-            .then(r => r.json())
-            .then(data => {
-                const list = document.getElementById('savedList');
-                list.innerHTML = '';
-                for(let name in data) {
-                    const div = document.createElement('div');
-                    div.className = 'saved-cmd';
-                    div.innerHTML = `
-                        <strong>${name}:</strong> ${data[name].command}
-                        <button onclick="executeCommand('${name}')">Execute</button>
-                        <button class="delete-btn" onclick="deleteCommand('${name}')">Delete</button>
-                    `;
-                    list.appendChild(div);
-                }
-            });
-        }
-        
-        loadSaved();
-        setInterval(loadSaved, 5000);
-    </script>
-</body>
-</html>
-'''
+    with _saved_lock:
+        found = saved_commands.pop(name, None) is not None
+    if found:
+        return ojsonify({'status': 'deleted', 'name': name})
+    return _ERR_NOT_FOUND()
 
 if __name__ == '__main__':
     # Get local IP
@@ -256,7 +268,9 @@ if __name__ == '__main__':
     print(f"🔌 Access at: http://{local_ip}:5001")
     print(f"📡 Command endpoint: /api/command/get")
     print(f"🌍 Public URL: https://6fbx0j5c-5001.inc1.devtunnels.ms")
+    print("🚀 Production: gunicorn -k gevent -w 1 --worker-connections 1000 --keep-alive 60 -b 0.0.0.0:5001 firmware_server_simple:app")
     print("="*60 + "\n")
     
-    # Run server on all interfaces
-    app.run(host='0.0.0.0', port=5001, debug=True)
+    # Development server for smoke tests only; use the gunicorn command above.
+    # Werkzeug closes every connection, so keep-alive needs gunicorn.
+    app.run(host='0.0.0.0', port=5001, threaded=True)
@@ -0,0 +1,18 @@
+#!/usr/bin/env python3
+"""
+WSGI entry point for the Arduino Command Center
+Run under gunicorn instead of Flask's development server:
+
+    gunicorn -w 1 --threads 16 --keep-alive 75 -b 0.0.0.0:3000 wsgi:application
+
+Keep a single worker: the command queue, saved commands and device logs
+live in process memory and are not shared between workers.
+
+Size --threads for the long-lived requests: each open web UI tab holds one
+thread for its /api/logs/stream (re-opened every LOG_STREAM_MAX_AGE
+seconds), and the ESP8266's ?wait= long-poll holds another for up to 30 s.
+16 threads leaves room for a handful of tabs plus the device and the UI's
+POSTs; raise it if more tabs stay open.
+"""
+
+from firmware_server import app as application
@@ -16,6 +16,49 @@ const bool useHttps = true;
 // CRITICAL: WiFiClientSecure must be GLOBAL for HTTPS
 WiFiClientSecure wifiClient;
 
+// Global too, so the TLS connection is kept alive and reused between polls
+HTTPClient http;
+
+// Commands fetched per poll (server caps this at 16)
+const int POLL_BATCH = 8;
+
+// Long-poll: the server holds each request open until a command is queued
+// or this many seconds pass, so commands arrive without a fixed poll delay
+const int POLL_WAIT_SECONDS = 20;
+
+// Translate a server command to JSON and forward it to the Arduino
+void forwardCommand(const char* command) {
+    Serial.print("📨 Command received: ");
+    Serial.println(command);
+    
+    // Create JSON command for Arduino
+    String jsonCmd = "";
+    String cmd = String(command);
+    
+    if (cmd == "BLINK_FAST") {
+        jsonCmd = "{\"type\":\"blink\",\"duration\":200}";
+    } else if (cmd == "BLINK_SLOW") {
+        jsonCmd = "{\"type\":\"blink\",\"duration\":1000}";
+    } else if (cmd == "LED_ON") {
+        jsonCmd = "{\"type\":\"led_on\"}";
+    } else if (cmd == "LED_OFF") {
+        jsonCmd = "{\"type\":\"led_off\"}";
+    } else if (cmd == "STOP") {
+        jsonCmd = "{\"type\":\"stop\"}";
+    } else if (cmd == "STATUS") {
+        jsonCmd = "{\"type\":\"status\"}";
+    } else {
+        // Forward raw command
+        jsonCmd = command;
+    }
+    
+    // Forward to Arduino on Serial
+    Serial.println(jsonCmd);
+    Serial.print("✅ Forwarded: ");
+    Serial.println(jsonCmd);
+    Serial.println();
+}
+
 void setup() {
     Serial.begin(115200);
     delay(500);
@@ -23,6 +66,9 @@ void setup() {
     // CRITICAL: Disable SSL certificate validation for HTTPS
     wifiClient.setInsecure();
     
+    // Keep the connection open after each poll instead of reconnecting
+    http.setReuse(true);
+    
     Serial.println("\n\n=== ESP8266 WiFi Bridge ===");
     Serial.print("Connecting to WiFi: ");
     Serial.println(ssid);
@@ -63,59 +109,32 @@ void loop() {
     }
     
     // Poll server for commands
-    HTTPClient http;
-    
-    String url = String(serverUrl) + "/api/command/get";
+    // Drain up to POLL_BATCH queued commands in one round trip
+    String url = String(serverUrl) + "/api/command/get?max=" + String(POLL_BATCH)
+               + "&wait=" + String(POLL_WAIT_SECONDS);
     
     // Use global wifiClient for HTTPS
     http.begin(wifiClient, url);
-    http.setTimeout(5000);
+    http.setTimeout((POLL_WAIT_SECONDS + 5) * 1000);
     
     int httpCode = http.GET();
     
     if (httpCode == 200) {
         String payload = http.getString();
         
-        // Parse JSON response
-        StaticJsonDocument<200> doc;
+        // Parse JSON response: {"commands": [{"command": ..., "timestamp": ...}, ...]}
+        DynamicJsonDocument doc(2048);
         DeserializationError error = deserializeJson(doc, payload);
         
         if (!error) {
-            const char* command = doc["command"];
-            
-            if (command != nullptr && strlen(command) > 0) {
-                // Got a command! Parse and format as JSON for Arduino
-                Serial.print("📨 Command received: ");
-                Serial.println(command);
-                
-                // Create JSON command for Arduino
-                String jsonCmd = "";
-                String cmd = String(command);
-                
-                if (cmd == "BLINK_FAST") {
-                    jsonCmd = "{\"type\":\"blink\",\"duration\":200}";
-                } else if (cmd == "BLINK_SLOW") {
-                    jsonCmd = "{\"type\":\"blink\",\"duration\":1000}";
-                } else if (cmd == "LED_ON") {
-                    jsonCmd = "{\"type\":\"led_on\"}";
-                } else if (cmd == "LED_OFF") {
-                    jsonCmd = "{\"type\":\"led_off\"}";
-                } else if (cmd == "STOP") {
-                    jsonCmd = "{\"type\":\"stop\"}";
-                } else if (cmd == "STATUS") {
-                    jsonCmd = "{\"type\":\"status\"}";
-                } else {
-                    // Forward raw command
-                    jsonCmd = command;
+            JsonArray commands = doc["commands"].as<JsonArray>();
+            for (JsonObject entry : commands) {
+                const char* command = entry["command"];
+                if (command != nullptr && strlen(command) > 0) {
+                    forwardCommand(command);
                 }
-                
-                // Forward to Arduino on Serial
-                Serial.println(jsonCmd);
-                Serial.print("✅ Forwarded: ");
-                Serial.println(jsonCmd);
-                Serial.println();
             }
-            // If command is null, no command available (silent)
+            // An empty array means no command available (silent)
         } else {
             Serial.print("⚠️ JSON parse error: ");
             Serial.println(error.c_str());
@@ -130,6 +149,7 @@ void loop() {
     
     http.end();
     
-    delay(3000);  // Poll every 3 seconds
+    // The server already waited for us; only back off after a failure
+    delay(httpCode == 200 ? 100 : 3000);
     yield();
 }